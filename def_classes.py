@@ -1,5 +1,14 @@
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
 from telebot.types import Message
-from typing import Tuple, Optional, List, Dict
+from typing import Tuple, Optional, List, Dict, Deque, Hashable, Any, Callable
+from collections import deque, OrderedDict
 
 
 class User:
@@ -10,12 +19,14 @@ class User:
         - текст команды, введенной пользователем;
         - имя пользователя;
         - язык, на котором пользователь вводит название города, по умолчанию - русский;
+        - валюта, в которой пользователь вводит и получает стоимость номеров, по умолчанию - рубли;
         - город, в котором осуществляется поиск отелей, в виде кортежа, где одно значение - ID города, а второе -
     название города;
         - словарь из всех найденных городов по шаблону пользователя, где ключ - ID, значение - название города;
         - количество отелей, отображаемых в результатах поиска, запрошенное пользователем;
         - минимальную, максимальную запрошенные стоимости номера за ночь;
         - минимальное, максимальное запрошенные расстояния от центра города до отеля;
+        - координаты точки (широта и долгота), рядом с которой ищутся отели по команде /nearby;
         - список всех найденных отелей в выбранном пользователем городе. Элементы списка - экземпляры класса Hotel.
     """
 
@@ -24,6 +35,7 @@ class User:
         self.__command: str = message.text
         self.__user_name: str = message.from_user.username
         self.__locale: str = 'ru_RU'
+        self.__currency: str = 'RUB'
         self.__city: Optional[Tuple[str]] = None
         self.__founded_cities: Dict[str] = dict()
         self.__hotels_num: str = '0'
@@ -31,12 +43,13 @@ class User:
         self.__max_price: str = '1000000000'
         self.__min_distance: str = '0'
         self.__max_distance: str = '1000000000'
+        self.__location: Optional[Tuple[float, float]] = None
         self.__founded_hotels: Optional[List['Hotel']] = None
 
     def __str__(self):
         return 'User: {user_name}, command: {command}, search in city: {city}\n' \
                'search settings:\n' \
-               'locale = {locale}\n' \
+               'locale = {locale}, currency = {currency}\n' \
                'number of hotels = {hotels_num}\n' \
                'min_price = {min_price}, max_price = {max_price},\n' \
                'min_distance = {min_distance}, max_distance = {max_distance}'.format(
@@ -44,6 +57,7 @@ class User:
                     command=self.__command,
                     city=self.__city,
                     locale=self.__locale,
+                    currency=self.__currency,
                     hotels_num=self.__hotels_num,
                     min_price=self.__min_price,
                     max_price=self.__max_price,
@@ -71,6 +85,11 @@ class User:
         """Геттер. Возвращает значение языка, на котором пользователь вводит название города"""
         return self.__locale
 
+    @property
+    def currency(self) -> str:
+        """Геттер. Возвращает валюту, в которой пользователь вводит и получает стоимость номеров"""
+        return self.__currency
+
     @property
     def city(self) -> Tuple[str]:
         """Геттер. Возвращает город, в котором осуществляется поиск"""
@@ -106,6 +125,11 @@ class User:
         """Геттер. Возвращает максимальное запрошенное расстояние от центра города до отеля"""
         return self.__max_distance
 
+    @property
+    def location(self) -> Optional[Tuple[float, float]]:
+        """Геттер. Возвращает координаты точки, рядом с которой ищутся отели"""
+        return self.__location
+
     @property
     def founded_hotels(self) -> Optional[List['Hotel']]:
         """Геттер. Возвращает список всех найденных отелей в выбранном пользователем городе"""
@@ -135,6 +159,24 @@ class User:
         else:
             raise TypeError('TypeError! The locale value must be "str"')
 
+    @currency.setter
+    def currency(self, new_currency: str) -> None:
+        """ Сеттер. Сохраняет валюту, в которой пользователь вводит и получает стоимость номеров.
+
+            Диапазон стоимости номера был введен в прежней валюте, поэтому при смене валюты он сбрасывается к
+        значениям по умолчанию.
+        """
+        if isinstance(new_currency, str):
+            if new_currency in ExchangeRates.CURRENCIES:
+                if new_currency != self.__currency:
+                    self.__min_price, self.__max_price = '0', '1000000000'
+                self.__currency = new_currency
+            else:
+                raise ValueError('ValueError! The currency value must be one of {}'.format(
+                    ', '.join(ExchangeRates.CURRENCIES)))
+        else:
+            raise TypeError('TypeError! The currency value must be "str"')
+
     @command.setter
     def command(self, new_command: str) -> None:
         """Сеттер. Сохраняет команду, которую ввел пользователь"""
@@ -203,6 +245,17 @@ class User:
         else:
             raise ValueError('ValueError! The distance must be "int"')
 
+    @location.setter
+    def location(self, new_location: Tuple[float, float]) -> None:
+        """Сеттер. Сохраняет координаты точки, рядом с которой ищутся отели"""
+        if isinstance(new_location, tuple) and len(new_location) == 2:
+            if -90 <= new_location[0] <= 90 and -180 <= new_location[1] <= 180:
+                self.__location = (float(new_location[0]), float(new_location[1]))
+            else:
+                raise ValueError('ValueError! The latitude must be from -90 to 90, the longitude - from -180 to 180')
+        else:
+            raise TypeError('TypeError! The location should be "tuple" with the latitude and the longitude')
+
     @founded_hotels.setter
     def founded_hotels(self, new_founded_hotels: List['Hotel']) -> None:
         """Сеттер. Сохраняет список найденных отелей"""
@@ -215,22 +268,34 @@ class Hotel:
         Содержит следующую информацию:
         - название;
         - адрес;
-        - расстояние до центра от отеля;
-        - стоимость одной ночи проживания в отеле.
+        - расстояние до центра от отеля в километрах;
+        - стоимость одной ночи проживания в отеле в базовой валюте (рублях);
+        - ID отеля и его координаты (широта и долгота), если они известны.
     """
-    def __init__(self, name: str, address: str, distance: str, price: str):
+    def __init__(self, name: str, address: str, distance: float, price: float, hotel_id: Optional[int] = None,
+                 latitude: Optional[float] = None, longitude: Optional[float] = None):
         self.__name = name
         self.__address = address
         self.__distance = distance
         self.__price = price
+        self.__id = hotel_id
+        self.__latitude = latitude
+        self.__longitude = longitude
 
     def __str__(self):
+        return self.description(price='{:,.0f} RUB'.format(self.__price).replace(',', ' '))
+
+    def description(self, price: str) -> str:
+        """ Метод возвращает информационное сообщение об отеле.
+
+            Стоимость передается уже переведенной в валюту пользователя и отформатированной.
+        """
         return 'Отель "{name}":\n\t- адрес: {address}\n\t' \
-               '- расстояние до центра города: {distance}\n\t- стоимость одной ночи проживания: {price}'.format(
+               '- расстояние до центра города: {distance} км\n\t- стоимость одной ночи проживания: {price}'.format(
                     name=self.__name,
                     address=self.__address,
-                    distance=self.__distance,
-                    price=self.__price,
+                    distance='{:.1f}'.format(self.__distance).replace('.', ','),
+                    price=price,
                     )
 
     @property
@@ -244,11 +309,562 @@ class Hotel:
         return self.__address
 
     @property
-    def distance(self) -> str:
-        """Геттер. Возвращает расстояние от центра города до отеля"""
+    def distance(self) -> float:
+        """Геттер. Возвращает расстояние от центра города до отеля в километрах"""
         return self.__distance
 
     @property
-    def price(self) -> str:
-        """Геттер. Возвращает стоимость номера за ночь в отеле"""
+    def price(self) -> float:
+        """Геттер. Возвращает стоимость номера за ночь в отеле в базовой валюте"""
         return self.__price
+
+    @property
+    def id(self) -> Optional[int]:
+        """Геттер. Возвращает ID отеля"""
+        return self.__id
+
+    @property
+    def latitude(self) -> Optional[float]:
+        """Геттер. Возвращает широту, на которой находится отель"""
+        return self.__latitude
+
+    @property
+    def longitude(self) -> Optional[float]:
+        """Геттер. Возвращает долготу, на которой находится отель"""
+        return self.__longitude
+
+
+class ApiUnavailableError(Exception):
+    """Исключение, возникающее при обращении к эндпоинту API, автоматический выключатель которого разомкнут."""
+
+
+class CircuitBreaker:
+    """ Класс, реализующий автоматический выключатель (circuit breaker) для одного эндпоинта API.
+
+        Содержит следующую информацию:
+        - состояние выключателя: замкнут (запросы проходят), разомкнут (запросы сразу отклоняются), полуоткрыт (на
+    сервер пропускается один пробный запрос);
+        - количество подряд неудачных запросов, после которого выключатель размыкается;
+        - время в секундах, по истечении которого разомкнутый выключатель переходит в полуоткрытое состояние;
+        - количество подряд неудачных запросов и время последнего размыкания.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 3, recovery_time: float = 30.0):
+        self.__failure_threshold = failure_threshold
+        self.__recovery_time = recovery_time
+        self.__state = self.CLOSED
+        self.__failures_count = 0
+        self.__opened_at = 0.0
+        self.__probe_in_flight = False
+        self.__lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """Геттер. Возвращает текущее состояние выключателя"""
+        with self.__lock:
+            if self.__state == self.OPEN and time.monotonic() - self.__opened_at >= self.__recovery_time:
+                return self.HALF_OPEN
+            return self.__state
+
+    def allow_request(self) -> bool:
+        """ Метод проверяет, можно ли отправить запрос на сервер.
+
+            В замкнутом состоянии пропускает все запросы. В разомкнутом - отклоняет все запросы, пока не истечет время
+        восстановления, после чего переходит в полуоткрытое состояние и пропускает на сервер один пробный запрос.
+        Остальные запросы отклоняются до получения результата пробного запроса.
+        """
+        with self.__lock:
+            if self.__state == self.CLOSED:
+                return True
+            if self.__state == self.OPEN and time.monotonic() - self.__opened_at >= self.__recovery_time:
+                self.__state = self.HALF_OPEN
+                self.__probe_in_flight = False
+            if self.__state == self.HALF_OPEN and not self.__probe_in_flight:
+                self.__probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        """Метод сохраняет успешный результат запроса и замыкает выключатель"""
+        with self.__lock:
+            self.__state = self.CLOSED
+            self.__failures_count = 0
+            self.__probe_in_flight = False
+
+    def record_failure(self) -> None:
+        """ Метод сохраняет неудачный результат запроса.
+
+            Размыкает выключатель, если неудачным оказался пробный запрос или количество подряд неудачных запросов
+        достигло порогового значения.
+        """
+        with self.__lock:
+            self.__failures_count += 1
+            if self.__state == self.HALF_OPEN or self.__failures_count >= self.__failure_threshold:
+                self.__state = self.OPEN
+                self.__opened_at = time.monotonic()
+                self.__probe_in_flight = False
+
+
+class LatencyTracker:
+    """ Класс, накапливающий время ответа сервера для одного эндпоинта API.
+
+        Хранит время последних успешных ответов в скользящем окне заданного размера и вычисляет по ним 95-й
+    перцентиль, который используется как задержка перед отправкой дублирующего (hedged) запроса.
+    """
+    def __init__(self, window: int = 100, min_samples: int = 20):
+        self.__latencies: Deque[float] = deque(maxlen=window)
+        self.__min_samples = min_samples
+        self.__lock = threading.Lock()
+
+    def add(self, latency: float) -> None:
+        """Метод сохраняет время ответа сервера в секундах"""
+        with self.__lock:
+            self.__latencies.append(latency)
+
+    @property
+    def p95(self) -> Optional[float]:
+        """Геттер. Возвращает 95-й перцентиль времени ответа или None, если накоплено недостаточно замеров"""
+        with self.__lock:
+            if len(self.__latencies) < self.__min_samples:
+                return None
+            latencies = sorted(self.__latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+
+class ApiEndpoint:
+    """ Класс, содержащий информацию об эндпоинте API hotels4.
+
+        Содержит следующую информацию:
+        - адрес эндпоинта;
+        - автоматический выключатель эндпоинта (экземпляр класса CircuitBreaker);
+        - статистику времени ответа эндпоинта (экземпляр класса LatencyTracker).
+    """
+    def __init__(self, url: str):
+        self.__url = url
+        self.__breaker = CircuitBreaker()
+        self.__latency = LatencyTracker()
+
+    @property
+    def url(self) -> str:
+        """Геттер. Возвращает адрес эндпоинта"""
+        return self.__url
+
+    @property
+    def breaker(self) -> CircuitBreaker:
+        """Геттер. Возвращает автоматический выключатель эндпоинта"""
+        return self.__breaker
+
+    @property
+    def latency(self) -> LatencyTracker:
+        """Геттер. Возвращает статистику времени ответа эндпоинта"""
+        return self.__latency
+
+
+class ResponseCache:
+    """ Класс, реализующий кэш ответов сервера.
+
+        Ответ считается свежим в течение ttl секунд и возвращается вместо запроса на сервер. Устаревший ответ хранится
+    еще stale_ttl секунд и возвращается только по явному запросу - когда сервер недоступен. При превышении max_size
+    записей удаляются самые давно использованные записи.
+    """
+    def __init__(self, ttl: float = 900.0, stale_ttl: float = 86400.0, max_size: int = 1000):
+        self.__ttl = ttl
+        self.__stale_ttl = stale_ttl
+        self.__max_size = max_size
+        self.__data: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key: Hashable, allow_stale: bool = False) -> Optional[Any]:
+        """Метод возвращает сохраненный ответ или None, если ответа нет или он устарел"""
+        with self.__lock:
+            item = self.__data.get(key)
+            if item is None:
+                return None
+            age = time.monotonic() - item[0]
+            if age > self.__ttl + self.__stale_ttl:
+                del self.__data[key]
+                return None
+            if age > self.__ttl and not allow_stale:
+                return None
+            self.__data.move_to_end(key)
+            return item[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Метод сохраняет ответ сервера"""
+        with self.__lock:
+            self.__data[key] = (time.monotonic(), value)
+            self.__data.move_to_end(key)
+            while len(self.__data) > self.__max_size:
+                self.__data.popitem(last=False)
+
+
+class RateLimiter:
+    """ Класс, ограничивающий частоту запросов к API hotels4 в соответствии с квотой (алгоритм token bucket).
+
+        Квота пополняется со скоростью rate запросов в секунду, но не больше burst запросов. Если квота исчерпана, то
+    поток, отправляющий запрос, ожидает ее пополнения.
+    """
+    def __init__(self, rate: float = 5.0, burst: int = 5):
+        self.__rate = rate
+        self.__burst = burst
+        self.__tokens = float(burst)
+        self.__updated_at = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def __take(self) -> float:
+        """Метод расходует квоту на один запрос и возвращает 0 или, если квота исчерпана, время до ее пополнения"""
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(self.__burst, self.__tokens + (now - self.__updated_at) * self.__rate)
+            self.__updated_at = now
+            if self.__tokens >= 1:
+                self.__tokens -= 1
+                return 0
+            return (1 - self.__tokens) / self.__rate
+
+    def acquire(self) -> None:
+        """Метод ожидает пополнения квоты и расходует ее на один запрос"""
+        wait_time = self.__take()
+        while wait_time > 0:
+            time.sleep(wait_time)
+            wait_time = self.__take()
+
+    def try_acquire(self) -> bool:
+        """Метод расходует квоту на один запрос без ожидания, возвращает False, если квота исчерпана"""
+        return self.__take() == 0
+
+
+class ExchangeRates:
+    """ Класс, содержащий курсы валют относительно базовой валюты (рубля).
+
+        Отели запрашиваются у сервера и кэшируются только в базовой валюте, а стоимость в валюте пользователя
+    вычисляется при выводе результатов. Курсы обновляются по таймеру, до первого обновления доступна только базовая
+    валюта.
+    """
+    BASE_CURRENCY = 'RUB'
+    CURRENCIES = ('RUB', 'USD', 'EUR')
+
+    def __init__(self):
+        self.__rates: Dict[str, float] = {self.BASE_CURRENCY: 1.0}
+        self.__lock = threading.Lock()
+
+    def update(self, new_rates: Dict[str, float]) -> None:
+        """Метод сохраняет новые курсы валют: стоимость одной единицы валюты в базовой валюте"""
+        with self.__lock:
+            self.__rates = {currency: rate for currency, rate in new_rates.items() if rate > 0}
+            self.__rates[self.BASE_CURRENCY] = 1.0
+
+    def convert(self, amount: float, currency: str) -> Optional[float]:
+        """Метод переводит сумму из базовой валюты в указанную, возвращает None, если курс валюты неизвестен"""
+        with self.__lock:
+            rate = self.__rates.get(currency)
+        if rate is None:
+            return None
+        return amount / rate
+
+    def available(self, currency: str) -> bool:
+        """Метод проверяет, известен ли курс указанной валюты"""
+        with self.__lock:
+            return currency in self.__rates
+
+    def to_base(self, amount: float, currency: str) -> Optional[float]:
+        """Метод переводит сумму из указанной валюты в базовую, возвращает None, если курс валюты неизвестен"""
+        with self.__lock:
+            rate = self.__rates.get(currency)
+        if rate is None:
+            return None
+        return amount * rate
+
+    def format(self, amount: float, currency: str) -> str:
+        """ Метод возвращает сумму в базовой валюте, переведенную в указанную валюту, в виде текста.
+
+            Если курс валюты неизвестен, то сумма выводится в базовой валюте.
+        """
+        converted = self.convert(amount, currency)
+        if converted is None:
+            converted, currency = amount, self.BASE_CURRENCY
+        return '{:,.0f} {}'.format(converted, currency).replace(',', ' ')
+
+
+class HotelsIndex:
+    """ Класс, реализующий пространственный индекс по координатам найденных отелей.
+
+        Отели раскладываются по ячейкам равномерной сетки размером cell_size градусов. При поиске отелей рядом с точкой
+    просматриваются только ячейки, попадающие в заданный радиус, а расстояние до каждого отеля из этих ячеек вычисляется
+    по формуле гаверсинусов. Для каждого отеля хранится последний сохраненный экземпляр класса Hotel.
+        Стоимость номера зависит от даты заезда, поэтому в индексе хранятся отели только на самую позднюю из
+    сохраненных дат заезда: при сохранении отелей на более позднюю дату отели на прежнюю дату удаляются, а отели на
+    более раннюю дату не сохраняются. Поэтому индекс не растет неограниченно и не смешивает цены разных дат.
+    """
+    EARTH_RADIUS = 6371.0  # радиус Земли в километрах
+    KM_PER_DEGREE = 111.2  # длина одного градуса широты в километрах
+
+    def __init__(self, cell_size: float = 0.05):
+        self.__cell_size = cell_size
+        self.__cells: Dict[Tuple[int, int], Dict[int, Tuple[float, float, float, Hotel]]] = dict()
+        self.__hotels_cells: Dict[int, Tuple[int, int]] = dict()
+        self.__check_in: Optional[str] = None
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__hotels_cells)
+
+    def __cell(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        """Метод возвращает ячейку сетки, в которую попадает точка"""
+        return math.floor(latitude / self.__cell_size), math.floor(longitude / self.__cell_size)
+
+    def add(self, hotels: List[Hotel], check_in: str) -> None:
+        """ Метод сохраняет в индекс отели на дату заезда check_in в формате ГГГГ-ММ-ДД.
+
+            Отели без ID или без координат пропускаются. Если отель уже есть в индексе, то он заменяется новым.
+        """
+        with self.__lock:
+            if self.__check_in is not None and check_in < self.__check_in:
+                return
+            if check_in != self.__check_in:
+                self.__cells.clear()
+                self.__hotels_cells.clear()
+                self.__check_in = check_in
+            for hotel in hotels:
+                if hotel.id is None or hotel.latitude is None or hotel.longitude is None:
+                    continue
+                old_cell = self.__hotels_cells.get(hotel.id)
+                if old_cell is not None:
+                    del self.__cells[old_cell][hotel.id]
+                    if len(self.__cells[old_cell]) == 0:
+                        del self.__cells[old_cell]
+                cell = self.__cell(hotel.latitude, hotel.longitude)
+                latitude = math.radians(hotel.latitude)
+                self.__cells.setdefault(cell, dict())[hotel.id] = (latitude, math.radians(hotel.longitude),
+                                                                   math.cos(latitude), hotel)
+                self.__hotels_cells[hotel.id] = cell
+
+    def nearby(self, latitude: float, longitude: float, radius: float) -> List[Tuple[float, Hotel]]:
+        """ Метод возвращает отели, находящиеся не дальше radius километров от точки.
+
+            Возвращает список кортежей из расстояния до точки в километрах и экземпляра класса Hotel, отсортированный
+        по возрастанию расстояния.
+        """
+        lat_cells = math.ceil(radius / self.KM_PER_DEGREE / self.__cell_size)
+        lon_cells = math.ceil(radius / (self.KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+                              / self.__cell_size)
+        center_lat, center_lon = self.__cell(latitude, longitude)
+        with self.__lock:
+            candidates = [item
+                          for i_cell in range(center_lat - lat_cells, center_lat + lat_cells + 1)
+                          for j_cell in range(center_lon - lon_cells, center_lon + lon_cells + 1)
+                          for item in self.__cells.get((i_cell, j_cell), dict()).values()]
+
+        point_lat, point_lon = math.radians(latitude), math.radians(longitude)
+        point_cos = math.cos(point_lat)
+        result = []
+        for hotel_lat, hotel_lon, hotel_cos, hotel in candidates:
+            haversine = (math.sin((hotel_lat - point_lat) / 2) ** 2
+                         + point_cos * hotel_cos * math.sin((hotel_lon - point_lon) / 2) ** 2)
+            distance = 2 * self.EARTH_RADIUS * math.asin(math.sqrt(haversine))
+            if distance <= radius:
+                result.append((distance, hotel))
+        result.sort(key=lambda item: item[0])
+        return result
+
+
+class SearchScheduler:
+    """ Класс, реализующий планировщик долгих поисковых задач пользователей (поиск городов и отелей).
+
+        Задачи выполняются фиксированным количеством рабочих потоков. У каждого пользователя одновременно выполняется
+    не больше max_running_per_user задач, и в очереди хранится только одна, самая новая, задача: новая задача
+    пользователя заменяет его ожидающую задачу, а уже выполняющаяся задача считается устаревшей и может проверить это
+    методом cancelled(). Методом cancel() можно отменить все задачи пользователя без постановки новой. Пользователи
+    обслуживаются по очереди (round-robin), поэтому один пользователь не может занять все рабочие потоки. Если в
+    очереди уже max_queued задач, то новая задача отклоняется.
+    """
+    def __init__(self, workers: int = 4, max_queued: int = 20, max_running_per_user: int = 1):
+        self.__max_queued = max_queued
+        self.__max_running_per_user = max_running_per_user
+        self.__pending: Dict[int, Tuple[int, Callable]] = dict()
+        self.__generations: Dict[int, int] = dict()
+        self.__running: Dict[int, int] = dict()
+        self.__ready: Deque[int] = deque()
+        self.__condition = threading.Condition()
+        self.__local = threading.local()
+        for _ in range(workers):
+            threading.Thread(target=self.__work, daemon=True).start()
+
+    def submit(self, user_id: int, task: Callable) -> bool:
+        """ Метод ставит задачу пользователя в очередь.
+
+            Если у пользователя уже есть ожидающая задача, то она заменяется новой. Возвращает False, если очередь
+        переполнена и задача отклонена.
+        """
+        with self.__condition:
+            if user_id not in self.__pending and len(self.__pending) >= self.__max_queued:
+                return False
+            generation = self.__generations.get(user_id, 0) + 1
+            self.__generations[user_id] = generation
+            if user_id not in self.__pending and self.__running.get(user_id, 0) < self.__max_running_per_user:
+                self.__ready.append(user_id)
+                self.__condition.notify()
+            self.__pending[user_id] = (generation, task)
+            return True
+
+    def cancel(self, user_id: int) -> None:
+        """Метод удаляет ожидающую задачу пользователя из очереди и помечает его выполняющиеся задачи устаревшими"""
+        with self.__condition:
+            if user_id not in self.__generations:
+                return
+            self.__generations[user_id] += 1
+            if self.__pending.pop(user_id, None) is not None and user_id in self.__ready:
+                self.__ready.remove(user_id)
+
+    def cancelled(self) -> bool:
+        """Метод проверяет, заменена ли выполняющаяся в текущем потоке задача более новой задачей пользователя"""
+        ticket = getattr(self.__local, 'ticket', None)
+        if ticket is None:
+            return False
+        with self.__condition:
+            return self.__generations.get(ticket[0]) != ticket[1]
+
+    def __work(self) -> None:
+        """Метод рабочего потока: по очереди выполняет задачи пользователей"""
+        while True:
+            with self.__condition:
+                while len(self.__ready) == 0:
+                    self.__condition.wait()
+                user_id = self.__ready.popleft()
+                generation, task = self.__pending.pop(user_id)
+                self.__running[user_id] = self.__running.get(user_id, 0) + 1
+
+            self.__local.ticket = (user_id, generation)
+            try:
+                task()
+            except Exception:
+                pass  # ошибки задач логируются декораторами самих задач
+            finally:
+                self.__local.ticket = None
+                with self.__condition:
+                    self.__running[user_id] -= 1
+                    if self.__running[user_id] == 0:
+                        del self.__running[user_id]
+                    if (user_id in self.__pending and user_id not in self.__ready
+                            and self.__running.get(user_id, 0) < self.__max_running_per_user):
+                        self.__ready.append(user_id)
+                        self.__condition.notify()
+
+
+class HotelsStore:
+    """ Класс, реализующий хранилище найденных отелей на диске, общее для всех процессов бота.
+
+        Каждый список отелей хранится в отдельном файле, имя которого составлено из ключа (ID города, порядок
+    сортировки, дата заезда). Файл содержит заголовок, записи фиксированной длины (ID отеля, стоимость номера,
+    расстояние до центра города, широта, долгота, смещения и длины названия и адреса) и пул строк в кодировке UTF-8.
+        Файлы читаются через mmap: числовые поля читаются прямо из отображенного файла, а строки декодируются только
+    для отелей, прошедших фильтр. Файл записывается во временный файл и атомарно заменяет старый, поэтому несколько
+    процессов могут одновременно читать и обновлять хранилище, а после перезапуска бота результаты не нужно получать
+    и разбирать заново.
+    """
+    MAGIC = b'HTLS'
+    HEADER = struct.Struct('<4sII')  # признак формата файла, количество отелей и длина пула строк
+    RECORD = struct.Struct('<qddddIIII')
+
+    def __init__(self, directory: str):
+        self.__directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def __path(self, key: Tuple[str, str, str]) -> str:
+        """Метод возвращает путь к файлу списка отелей с заданным ключом"""
+        return os.path.join(self.__directory, '{}_{}_{}.bin'.format(*key))
+
+    def age(self, key: Tuple[str, str, str]) -> Optional[float]:
+        """Метод возвращает время в секундах, прошедшее с сохранения списка отелей, или None, если списка нет"""
+        try:
+            return time.time() - os.path.getmtime(self.__path(key))
+        except OSError:
+            return None
+
+    def write(self, key: Tuple[str, str, str], hotels: List[Hotel]) -> None:
+        """ Метод сохраняет список отелей с заданным ключом.
+
+            Файлы списков отелей с более ранней датой заезда удаляются.
+        """
+        records = []
+        pool = bytearray()
+        for hotel in hotels:
+            name = hotel.name.encode('utf-8')
+            address = hotel.address.encode('utf-8')
+            records.append(self.RECORD.pack(
+                hotel.id if hotel.id is not None else -1,
+                hotel.price,
+                hotel.distance,
+                hotel.latitude if hotel.latitude is not None else math.nan,
+                hotel.longitude if hotel.longitude is not None else math.nan,
+                len(pool), len(name), len(pool) + len(name), len(address)))
+            pool += name + address
+
+        file_id, temp_path = tempfile.mkstemp(dir=self.__directory, suffix='.tmp')
+        try:
+            with os.fdopen(file_id, 'wb') as file:
+                file.write(self.HEADER.pack(self.MAGIC, len(records), len(pool)))
+                file.write(b''.join(records))
+                file.write(pool)
+            os.replace(temp_path, self.__path(key))
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+        for file_name in os.listdir(self.__directory):
+            if file_name.endswith('.bin') and file_name.rsplit('_', 1)[-1][:-len('.bin')] < key[2]:
+                try:
+                    os.remove(os.path.join(self.__directory, file_name))
+                except OSError:
+                    pass  # файл уже удален другим процессом
+
+    def find(self, key: Tuple[str, str, str],
+             min_price: float = -math.inf, max_price: float = math.inf,
+             min_distance: float = -math.inf, max_distance: float = math.inf,
+             limit: Optional[int] = None) -> Optional[List[Hotel]]:
+        """ Метод возвращает отели из списка с заданным ключом, стоимость номера (в базовой валюте) и расстояние до
+        центра города которых находятся строго внутри заданных диапазонов.
+
+            Отели возвращаются в порядке сохранения, не больше limit отелей. Если списка нет или его файл поврежден
+        (например, обрезан), то возвращает None, чтобы список был получен заново.
+        """
+        try:
+            file = open(self.__path(key), 'rb')
+        except OSError:
+            return None
+        with file:
+            try:
+                return self.__read(file, min_price, max_price, min_distance, max_distance, limit)
+            except (ValueError, struct.error):  # пустой, обрезанный или испорченный файл
+                return None
+
+    def __read(self, file, min_price: float, max_price: float, min_distance: float, max_distance: float,
+               limit: Optional[int]) -> Optional[List[Hotel]]:
+        """Метод читает из открытого файла отели, прошедшие фильтр, или возвращает None при неверном формате"""
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, count, pool_length = self.HEADER.unpack_from(data, 0)
+            pool_offset = self.HEADER.size + count * self.RECORD.size
+            if magic != self.MAGIC or len(data) != pool_offset + pool_length:
+                return None  # файл другого формата или обрезан
+            hotels = []
+            for offset in range(self.HEADER.size, pool_offset, self.RECORD.size):
+                if limit is not None and len(hotels) >= limit:
+                    break
+                hotel_id, price, distance, latitude, longitude, name_offset, name_length, address_offset, \
+                    address_length = self.RECORD.unpack_from(data, offset)
+                if not (min_price < price < max_price and min_distance < distance < max_distance):
+                    continue
+                name_offset += pool_offset
+                address_offset += pool_offset
+                hotels.append(Hotel(name=data[name_offset:name_offset + name_length].decode('utf-8'),
+                                    address=data[address_offset:address_offset + address_length].decode('utf-8'),
+                                    distance=distance,
+                                    price=price,
+                                    hotel_id=hotel_id if hotel_id != -1 else None,
+                                    latitude=latitude if not math.isnan(latitude) else None,
+                                    longitude=longitude if not math.isnan(longitude) else None))
+        return hotels
@@ -6,12 +6,19 @@ import time
 import requests
 import json
 import re
+import threading
+import math
+import copy
 
 from dotenv import load_dotenv
-from telebot.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from telebot.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, \
+    KeyboardButton, ReplyKeyboardRemove
 from collections.abc import Callable
-from def_classes import User, Hotel
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed
+from def_classes import User, Hotel, ApiEndpoint, ApiUnavailableError, ResponseCache, RateLimiter, ExchangeRates, \
+    HotelsIndex, SearchScheduler, HotelsStore
 from datetime import datetime, timedelta
+from typing import Tuple, Dict, List, Optional, Any
 
 
 load_dotenv()  # загрузка параметров из .env
@@ -28,6 +35,38 @@ logging.basicConfig(
     filemode='w')
 logger = logging.getLogger(name='bot_logger')
 
+api_endpoints = {
+    'locations/search': ApiEndpoint(url='https://hotels4.p.rapidapi.com/locations/search'),
+    'properties/list': ApiEndpoint(url='https://hotels4.p.rapidapi.com/properties/list'),
+}
+# эндпоинты API hotels4, у каждого свой автоматический выключатель и своя статистика времени ответа
+api_cache = ResponseCache()  # общий кэш ответов сервера для всех эндпоинтов
+search_workers = int(os.getenv('SEARCH_WORKERS', '4'))  # количество одновременно выполняемых поисковых задач
+compare_cities_num = 10  # максимальное количество городов в команде /compare
+api_executor = ThreadPoolExecutor(max_workers=2 * search_workers * (compare_cities_num + 1))
+# пул потоков для отправки дублирующих (hedged) запросов: места хватает на запрос и его дубль от каждого потока,
+# который может обращаться к серверу (рабочие потоки планировщика поиска и потоки поиска по городам для /compare)
+hedging = os.getenv('HEDGING', '0') == '1'
+# включение дублирующих запросов: если сервер не ответил за время, превышающее 95-й перцентиль времени ответа,
+# то отправляется второй такой же запрос и используется тот ответ, который придет первым
+api_rate_limiter = RateLimiter(rate=float(os.getenv('API_RATE_LIMIT', '5')))
+# общая квота запросов к API hotels4 в секунду для всех пользователей и эндпоинтов
+search_executor = ThreadPoolExecutor(max_workers=search_workers * compare_cities_num)
+# пул потоков для одновременного поиска в нескольких городах: каждая выполняющаяся поисковая задача может искать во
+# всех городах команды /compare одновременно, не занимая потоки поиска других пользователей
+exchange_rates = ExchangeRates()  # курсы валют для перевода стоимости номеров из базовой валюты в валюту пользователя
+exchange_rates_url = 'https://www.cbr-xml-daily.ru/daily_json.js'  # курсы валют ЦБ РФ относительно рубля
+exchange_rates_update_period = 3600  # период обновления курсов валют в секундах
+hotels_index = HotelsIndex()  # пространственный индекс по координатам отелей, полученных на сегодняшнюю дату
+hotels_store = HotelsStore(directory=os.getenv('HOTELS_STORE_DIR', 'hotels_store'))
+# хранилище найденных отелей на диске, общее для всех процессов бота и сохраняющееся после перезапуска
+hotels_store_ttl = 900  # время в секундах, в течение которого список отелей в хранилище считается актуальным
+nearby_radius = 10  # радиус поиска отелей рядом с точкой по команде /nearby в километрах
+search_scheduler = SearchScheduler(workers=search_workers,
+                                   max_queued=int(os.getenv('SEARCH_QUEUE_SIZE', '20')))
+# планировщик поисковых задач: не больше одного поиска на пользователя, пользователи обслуживаются по очереди
+compare_hotels_num = 3  # количество самых дешевых отелей каждого города, выводимых командой /compare
+
 
 def logger_dec_commands(func: Callable) -> Callable:
     """ Декоратор для логирования функций, обрабатывающих сообщения/команды пользователя.
@@ -89,6 +128,329 @@ def logger_dec_simple(func: Callable) -> Callable:
     return wrapper
 
 
+def scheduled_search(func: Callable) -> Callable:
+    """ Декоратор для функций, выполняющих долгий поиск по запросу пользователя (поиск городов и отелей).
+
+        Вместо немедленного выполнения ставит вызов функции в очередь планировщика search_scheduler от имени
+    пользователя, которому принадлежит сообщение или экземпляр класса User из первого аргумента. Вместо экземпляров
+    класса User в задачу передаются их копии, поэтому задача выполняется с параметрами поиска на момент постановки в
+    очередь, даже если пользователь уже начал вводить новую команду. Новый поиск пользователя заменяет его еще не
+    начавшийся поиск. Если очередь переполнена, то пользователю сразу выводится сообщение о перегрузке бота.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        args = [copy.copy(arg) if isinstance(arg, User) else arg for arg in args]
+        kwargs = {name: copy.copy(value) if isinstance(value, User) else value for name, value in kwargs.items()}
+        target = args[0] if args else next(iter(kwargs.values()))
+        user_id = target.id if isinstance(target, User) else target.from_user.id
+        if not search_scheduler.submit(user_id, functools.partial(func, *args, **kwargs)):
+            logger.warning(f'Search queue is full, "{func.__name__}" rejected for user {user_id}')
+            bot.send_message(user_id, 'Бот сейчас перегружен запросами, попробуйте повторить запрос через минуту.')
+    return wrapper
+
+
+def send_request(endpoint: ApiEndpoint, querystring: dict) -> dict:
+    """ Функция отправляет запрос к эндпоинту API hotels4 и возвращает ответ сервера в виде словаря.
+
+        Квота запросов должна быть уже получена вызывающей функцией. При успешном ответе сохраняет время ответа в
+    статистику эндпоинта. Если сервер вернул код ответа, отличный от 200, то вызывает исключение.
+    """
+    headers = {
+        'x-rapidapi-host': 'hotels4.p.rapidapi.com',
+        'x-rapidapi-key': os.getenv('KEY')
+    }
+    start_time = time.monotonic()
+    response = requests.request("GET", endpoint.url, headers=headers, params=querystring, timeout=10)
+    if response.status_code != 200:
+        raise requests.exceptions.HTTPError(f'Server returned status code {response.status_code}')
+    data = json.loads(response.text)
+    endpoint.latency.add(time.monotonic() - start_time)
+    return data
+
+
+def send_hedged_request(endpoint: ApiEndpoint, querystring: dict) -> dict:
+    """ Функция отправляет запрос к эндпоинту API hotels4 с дублированием.
+
+        Если дублирующие запросы выключены или время ответа эндпоинта еще не накоплено, то отправляет один запрос.
+    Иначе отправляет запрос и, если ответ не получен за время, равное 95-му перцентилю времени ответа эндпоинта,
+    отправляет второй такой же запрос. Возвращает первый успешный ответ, исключение вызывается только при ошибке обоих
+    запросов.
+        Перед отправкой запроса ожидает пополнения общей квоты запросов, а время ожидания ответа отсчитывается с
+    момента, когда запрос начал выполняться в пуле потоков, поэтому ни ожидание квоты, ни ожидание свободного потока
+    не учитываются при выборе момента дублирования. Дублирующий запрос отправляется, только если квота доступна без
+    ожидания.
+    """
+    api_rate_limiter.acquire()
+    hedge_delay = endpoint.latency.p95 if hedging else None
+    if hedge_delay is None:
+        return send_request(endpoint, querystring)
+
+    started = threading.Event()  # первый запрос начал выполняться, а не ждет свободного потока
+
+    def send_first_request() -> dict:
+        started.set()
+        return send_request(endpoint, querystring)
+
+    first_request = api_executor.submit(send_first_request)
+    started.wait()
+    done, _ = wait([first_request], timeout=hedge_delay)
+    if done:
+        return first_request.result()
+
+    if not api_rate_limiter.try_acquire():
+        logger.info(f'Request to {endpoint.url} was not hedged: request quota is exhausted')
+        return first_request.result()
+
+    logger.info(f'Hedged request to {endpoint.url} after {round(hedge_delay, 3)} s')
+    second_request = api_executor.submit(send_request, endpoint, querystring)
+    error = None
+    for request in as_completed([first_request, second_request]):
+        try:
+            return request.result()
+        except Exception as ex:
+            error = ex
+    raise error
+
+
+def request_api(endpoint_name: str, querystring: dict, parser: Optional[Callable] = None,
+                use_cache: bool = True) -> Any:
+    """ Функция получает данные от эндпоинта API hotels4 с учетом кэша и автоматического выключателя эндпоинта.
+
+        Если передана функция parser, то ответ сервера обрабатывается ею, и в кэше сохраняется уже обработанный
+    результат. Ошибки обработки ответа передаются дальше и не считаются ошибками сервера.
+        Если в кэше есть свежий ответ на такой же запрос, то возвращает его без обращения к серверу.
+        Если выключатель эндпоинта разомкнут, то сразу возвращает устаревший ответ из кэша, а при его отсутствии -
+    вызывает исключение ApiUnavailableError, не дожидаясь таймаута сервера.
+        При ошибке сервера сохраняет неудачу в выключатель эндпоинта и возвращает устаревший ответ из кэша, если он
+    есть, иначе - передает исключение дальше.
+        Если use_cache равен False, то кэш не используется: функция возвращает только данные, полученные от сервера,
+    а при разомкнутом выключателе или ошибке сервера передает исключение дальше.
+    """
+    endpoint = api_endpoints[endpoint_name]
+    cache_key = (endpoint_name, tuple(sorted(querystring.items())))
+    data = api_cache.get(cache_key) if use_cache else None
+    if data is not None:
+        return data
+
+    if not endpoint.breaker.allow_request():
+        data = api_cache.get(cache_key, allow_stale=True) if use_cache else None
+        if data is not None:
+            logger.warning(f'Circuit breaker of "{endpoint_name}" is open, stale data returned')
+            return data
+        raise ApiUnavailableError(f'Circuit breaker of "{endpoint_name}" is open')
+
+    try:
+        data = send_hedged_request(endpoint, querystring)
+    except Exception as ex:
+        endpoint.breaker.record_failure()
+        logger.error(f'Request to "{endpoint_name}" failed: {ex}, circuit breaker state: {endpoint.breaker.state}')
+        data = api_cache.get(cache_key, allow_stale=True) if use_cache else None
+        if data is not None:
+            logger.warning(f'Stale data of "{endpoint_name}" returned')
+            return data
+        raise
+
+    endpoint.breaker.record_success()
+    if parser is not None:
+        data = parser(data)
+    if use_cache:
+        api_cache.put(cache_key, data)
+    return data
+
+
+def update_exchange_rates() -> None:
+    """ Функция обновляет курсы валют и запускает таймер следующего обновления.
+
+        Курсы запрашиваются один раз для всех пользователей. При ошибке обновления сохраняются прежние курсы.
+    """
+    try:
+        response = requests.request("GET", exchange_rates_url, timeout=10)
+        if response.status_code != 200:
+            raise requests.exceptions.HTTPError(f'Server returned status code {response.status_code}')
+        rates_data = json.loads(response.text)
+        exchange_rates.update({currency: rate['Value'] / rate['Nominal']
+                               for currency, rate in rates_data['Valute'].items()})
+        logger.info('Exchange rates updated')
+    except Exception as ex:
+        logger.error(f'Exchange rates update failed: {ex}')
+    timer = threading.Timer(exchange_rates_update_period, update_exchange_rates)
+    timer.daemon = True
+    timer.start()
+
+
+def parse_city_name(text: str) -> Tuple[str, str]:
+    """ Функция подготавливает название города, введенное пользователем, для запроса на сервер.
+
+        Из текста выбираются только буквы русского или английского алфавитов, пробелы и дефисы. Возвращает кортеж из
+    подготовленного названия города и языка, на котором оно введено. Если в названии смешаны буквы разных алфавитов,
+    то вызывает исключение ValueError.
+    """
+    ru_alphabet = 'абвгдеёжзийклмнопрстуфхцчшщъыьэюя- '
+    en_alphabet = 'abcdefghijklmnopqrstuvwxyz- '
+    city_name = ''.join(letter for letter in text.lower() if letter in (ru_alphabet + en_alphabet))
+    # из запроса пользователя выбираем только буквы алфавита, пробелы и дефисы
+    #  проверяем, на каком языке ввел название города пользователь и сохраняем эту информацию для запросов
+    if all([True if sym in ru_alphabet else False for sym in city_name]):
+        return city_name, 'ru_RU'
+    elif all([True if sym in en_alphabet else False for sym in city_name]):
+        return city_name, 'en_EN'
+    raise ValueError('The name of the city was entered incorrectly. The name must contain characters of the '
+                     'Russian or English alphabet or space or "-"')
+
+
+def find_cities(city_name: str, locale: str) -> Dict[str, str]:
+    """ Функция ищет города по шаблону пользователя.
+
+        Возвращает словарь из всех найденных городов, где ключ - ID, значение - название города. При ошибке сервера
+    передает исключение дальше.
+    """
+    city_data = request_api('locations/search', {"query": city_name, "locale": locale})
+    founded_cities = dict()
+    for i_item in city_data['suggestions']:
+        if i_item['group'] == 'CITY_GROUP':
+            for j_item in i_item['entities']:
+                if j_item['type'] == 'CITY':
+                    founded_cities[j_item['destinationId']] = re.sub(r'<.*?>', '', j_item['caption'])
+    return founded_cities
+
+
+def hotels_querystring(city_id: str, sort_order: str) -> dict:
+    """ Функция формирует строку-запрос для поиска отелей в городе на сегодняшнюю ночь.
+
+        Запрос не зависит от команды, валюты и языка пользователя: отели всегда запрашиваются одной страницей из 50
+    отелей в базовой валюте и на базовом языке, поэтому все пользователи используют один и тот же ответ из кэша.
+    """
+    check_in_date = datetime.now().date()  # дата заезда - день запроса
+    check_out_date = check_in_date + timedelta(days=1)  # дата выезда - следующий день после дня запроса
+    return {"destinationId": city_id,
+            "pageNumber": "1",
+            "pageSize": "50",
+            "checkIn": str(check_in_date),
+            "checkOut": str(check_out_date),
+            "adults1": "1",
+            "sortOrder": sort_order,
+            "locale": 'ru_RU',
+            "currency": ExchangeRates.BASE_CURRENCY}
+
+
+def parse_hotel(hotel: dict) -> Hotel:
+    """ Функция формирует экземпляр класса Hotel из информации об отеле, полученной от сервера.
+
+        Если у отеля нет расширенного адреса, то в качестве адреса используется город отеля. Стоимость номера и
+    расстояние до центра города сохраняются в виде чисел.
+    """
+    if hotel.get('address').get('extendedAddress'):
+        if hotel['address']['extendedAddress'] != '':
+            hotel_address = ' '.join((hotel['address']['streetAddress'],
+                                      hotel['address']['extendedAddress'],
+                                      hotel['address']['locality']))
+        else:
+            hotel_address = ', '.join((hotel['address']['streetAddress'], hotel['address']['locality']))
+    else:
+        hotel_address = hotel['address'].get('locality', '')
+
+    hotel_distance = re.sub(r"[^0123456789,.]", "", hotel['landmarks'][0]['distance'])
+    hotel_distance = re.sub(r",", ".", hotel_distance)  # численное значение расстояния до центра города
+    hotel_price = hotel['ratePlan']['price'].get('exactCurrent')
+    if hotel_price is None:
+        hotel_price = re.sub(r"[^0123456789]", "", hotel['ratePlan']['price']['current'])
+    coordinate = hotel.get('coordinate', dict())
+    return Hotel(name=hotel['name'],
+                 address=hotel_address,
+                 distance=float(hotel_distance),
+                 price=float(hotel_price),
+                 hotel_id=hotel.get('id'),
+                 latitude=coordinate.get('lat'),
+                 longitude=coordinate.get('lon'))
+
+
+def parse_hotels(hotels_data: dict) -> List[Hotel]:
+    """ Функция формирует список экземпляров класса Hotel из ответа сервера на запрос поиска отелей.
+
+        Отели, информацию о которых не удалось разобрать (например, без стоимости номера или без расстояния до центра
+    города), пропускаются с записью в лог, чтобы один такой отель не приводил к ошибке поиска во всем городе.
+    """
+    if hotels_data['result'] != 'OK':
+        raise ValueError('Search hotels ERROR! Result is not "OK"')
+    hotels = []
+    for hotel in hotels_data['data']['body']['searchResults']['results']:
+        try:
+            hotels.append(parse_hotel(hotel))
+        except (KeyError, IndexError, TypeError, ValueError, AttributeError) as ex:
+            logger.warning('Hotel {hotel_id} skipped, unable to parse: {ex!r}'.format(hotel_id=hotel.get('id'), ex=ex))
+    return hotels
+
+
+def find_landmark(landmark_name: str, locale: str) -> Optional[Tuple[str, float, float]]:
+    """ Функция ищет достопримечательность (ориентир) по шаблону пользователя.
+
+        Возвращает кортеж из названия первого найденного ориентира, его широты и долготы или None, если ориентир не
+    найден. Используется тот же запрос к серверу, что и при поиске городов, поэтому ответ может быть взят из кэша.
+    """
+    landmark_data = request_api('locations/search', {"query": landmark_name, "locale": locale})
+    for i_item in landmark_data['suggestions']:
+        if i_item['group'] == 'LANDMARK_GROUP':
+            for j_item in i_item['entities']:
+                if j_item.get('latitude') is not None and j_item.get('longitude') is not None:
+                    return re.sub(r'<.*?>', '', j_item['caption']), j_item['latitude'], j_item['longitude']
+    return None
+
+
+def fetch_hotels(city_id: str, sort_order: str,
+                 min_price: float = -math.inf, max_price: float = math.inf,
+                 min_distance: float = -math.inf, max_distance: float = math.inf,
+                 limit: Optional[int] = None) -> List[Hotel]:
+    """ Функция возвращает отели в городе, отсортированные в заданном порядке, стоимость номера (в базовой валюте) и
+    расстояние до центра города которых находятся строго внутри заданных диапазонов, не больше limit отелей.
+
+        Если в хранилище нет списка отелей на сегодняшнюю дату или он старше hotels_store_ttl секунд, то список
+    запрашивается у сервера в базовой валюте и сохраняется в хранилище. Поэтому повторные поиски в том же городе в тот
+    же день не обращаются к серверу и не разбирают ответ заново, независимо от команды и валюты пользователя, в том
+    числе в других процессах бота и после его перезапуска. Кэш ответов сервера при этом не используется, чтобы в
+    хранилище со свежим временем сохранения не попал устаревший ответ. Поврежденный файл списка в хранилище считается
+    отсутствующим, и список запрашивается заново. Если сервер недоступен, а в хранилище есть устаревший список, то
+    используется он.
+        Ошибка записи в хранилище не прерывает поиск: она записывается в лог, а отели выбираются из полученного от
+    сервера списка.
+        Полученные отели сохраняются в пространственный индекс hotels_index с датой заезда для поиска отелей рядом с
+    точкой.
+    """
+    querystring = hotels_querystring(city_id=city_id, sort_order=sort_order)
+    check_in = querystring['checkIn']
+    store_key = (city_id, sort_order, check_in)
+    find_in_store = functools.partial(hotels_store.find, store_key,
+                                      min_price=min_price, max_price=max_price,
+                                      min_distance=min_distance, max_distance=max_distance,
+                                      limit=limit)
+    store_age = hotels_store.age(store_key)
+    if store_age is not None and store_age < hotels_store_ttl:
+        hotels = find_in_store()
+        if hotels is not None:
+            hotels_index.add(hotels, check_in=check_in)
+            return hotels
+        logger.warning(f'Hotels {store_key} in the store are damaged, requesting them again')
+        store_age = None
+
+    try:
+        hotels = request_api('properties/list', querystring, parser=parse_hotels, use_cache=False)
+    except Exception as ex:
+        hotels = find_in_store() if store_age is not None else None
+        if hotels is None:
+            raise
+        logger.warning(f'Stale hotels {store_key} returned from the store: {ex}')
+        hotels_index.add(hotels, check_in=check_in)
+        return hotels
+
+    hotels_index.add(hotels, check_in=check_in)
+    try:
+        hotels_store.write(store_key, hotels)
+    except OSError as ex:
+        logger.error(f'Hotels {store_key} were not saved to the store: {ex}')
+    hotels = [hotel for hotel in hotels
+              if min_price < hotel.price < max_price and min_distance < hotel.distance < max_distance]
+    return hotels[:limit]
+
+
 @logger_dec_simple
 def check_command(message: Message) -> bool:
     """ Функция проверяет, является ли сообщение от пользователя сообщением-командой.
@@ -102,7 +464,7 @@ def check_command(message: Message) -> bool:
     """
     if message.text.startswith('/'):
         logger.warning("Function was stopped by user's command")
-        commands = ['/start', '/help', '/lowprice', '/highprice', '/bestdeal']
+        commands = ['/start', '/help', '/lowprice', '/highprice', '/bestdeal', '/nearby', '/compare', '/currency']
         if message.text in commands:
             get_command_messages(message)
         else:
@@ -111,16 +473,19 @@ def check_command(message: Message) -> bool:
     return False
 
 
-@bot.message_handler(commands=['start', 'help', 'lowprice', 'highprice', 'bestdeal'])
+@bot.message_handler(commands=['start', 'help', 'lowprice', 'highprice', 'bestdeal', 'nearby', 'compare',
+                               'currency'])
 @logger_dec_commands
 def get_command_messages(message: Message) -> None:
-    """ Функция, обрабатывающая команды 'start', 'help', 'lowprice', 'highprice', 'bestdeal' от пользователя."""
+    """ Функция, обрабатывающая команды 'start', 'help', 'lowprice', 'highprice', 'bestdeal', 'nearby', 'compare',
+    'currency' от пользователя."""
     text = message.text
     if message.from_user.id not in users_list:
         users_list[message.from_user.id] = User(message=message)
     # создание экземпляра класса User конкретного пользователя и добавление его в список пользователей, если ранее не
     # был создан
     users_list[message.from_user.id].command = text  # сохранение информации о команде в экземпляр класса User
+    search_scheduler.cancel(message.from_user.id)  # новая команда отменяет незавершенный поиск пользователя
 
     if text == "/start":
         bot.send_message(message.from_user.id,
@@ -136,8 +501,25 @@ def get_command_messages(message: Message) -> None:
                          '/lowprice - Узнать топ самых дешёвых отелей в городе\n'
                          '/highprice - Узнать топ самых дорогих отелей в городе\n'
                          '/bestdeal - Узнать топ отелей, наиболее подходящих по цене и расположению от центра (самые '
-                         'дешёвые и находятся ближе всего к центру)\n\nДля того, чтобы остановить выполнение любой '
-                         'работающей команды, введите любую другую команду, начинающуюся на "/"')
+                         'дешёвые и находятся ближе всего к центру)\n'
+                         '/nearby - Узнать топ ближайших отелей к Вашему местоположению или достопримечательности\n'
+                         '/compare - Сравнить самые дешёвые отели в нескольких городах\n'
+                         '/currency - Выбрать валюту для ввода и вывода стоимости номеров\n\nДля того, чтобы '
+                         'остановить выполнение любой работающей команды, введите любую другую команду, начинающуюся '
+                         'на "/"')
+        return
+    elif text == "/compare":
+        bot.send_message(message.from_user.id, f"Введите через запятую города, в которых необходимо сравнить цены "
+                                               f"(не больше {compare_cities_num} городов):")
+        bot.register_next_step_handler(message, compare_cities)
+        return
+    elif text == "/currency":
+        keyboard = InlineKeyboardMarkup()
+        keyboard.add(*[InlineKeyboardButton(text=currency, callback_data=f'currency {currency}')
+                       for currency in ExchangeRates.CURRENCIES])
+        bot.send_message(message.from_user.id,
+                         f"Текущая валюта: {users_list[message.from_user.id].currency}. Выберите валюту:",
+                         reply_markup=keyboard)
         return
 
     bot.send_message(message.from_user.id, "Введите город, в котором необходимо выполнить поиск:")
@@ -165,6 +547,7 @@ def get_text_messages(message: Message) -> None:
                          'нажмите на неё).')
 
 
+@scheduled_search
 @logger_dec_commands
 def search_city(message: Message) -> None:
     """ Функция осуществляет поиск города, введенного пользователем.
@@ -179,24 +562,15 @@ def search_city(message: Message) -> None:
     интересует. Если пользователь выбрал конкретный город, то бот продолжает работу с этим городом. Если пользователь
     выбрал "Нужного мне города нет в списке", то пользователю предлагается ввести другой город, функция запускается
     заново.
+        Поиск выполняется в очереди планировщика search_scheduler. Если пока шел поиск пользователь запустил новый,
+    то результат поиска не выводится.
     """
     if check_command(message):
         return
 
-    ru_alphabet = 'абвгдеёжзийклмнопрстуфхцчшщъыьэюя- '
-    en_alphabet = 'abcdefghijklmnopqrstuvwxyz- '
     cur_user = users_list[message.from_user.id]
-    cur_city = ''.join(letter for letter in message.text.lower() if letter in (ru_alphabet + en_alphabet))
-    # из запроса пользователя выбираем только буквы алфавита, пробелы и дефисы
     try:
-        #  проверяем, на каком языке ввел название города пользователь и сохраняем эту информацию для запросов
-        if all([True if sym in ru_alphabet else False for sym in cur_city]):
-            cur_user.locale = 'ru_RU'
-        elif all([True if sym in en_alphabet else False for sym in cur_city]):
-            cur_user.locale = 'en_EN'
-        else:
-            raise ValueError('The name of the city was entered incorrectly. The name must contain characters of the '
-                             'Russian or English alphabet or space or "-"')
+        cur_city, cur_user.locale = parse_city_name(message.text)
     except (TypeError, ValueError) as ex:
         logger.error('Error: "{ex}" in "{func_name}"'.format(ex=ex, func_name=search_city.__name__))
         bot.send_message(message.from_user.id, 'Название города должно быть текстом на русском или английском языках, '
@@ -204,41 +578,31 @@ def search_city(message: Message) -> None:
         bot.register_next_step_handler(message, search_city)
         return
 
-    city_url = "https://hotels4.p.rapidapi.com/locations/search"
-    headers = {
-        'x-rapidapi-host': 'hotels4.p.rapidapi.com',
-        'x-rapidapi-key': os.getenv('KEY')
-    }
-    querystring = {"query": cur_city, "locale": cur_user.locale}
-
     bot.send_message(message.from_user.id, "Ожидайте результатов поиска города, это может занять какое-то время...")
     try:
         # в случае ошибки на сервере или превышении времени ожидания ответа - выдает соответствующее сообщение
-        response_city = requests.request("GET", city_url, headers=headers, params=querystring, timeout=10)
-        if response_city.status_code == 200:
-            city_data = json.loads(response_city.text)
-        else:
-            raise
+        founded_cities = find_cities(city_name=cur_city, locale=cur_user.locale)
     except Exception as ex:
+        if search_scheduler.cancelled():  # пользователь уже запустил новый поиск, результат этого поиска не нужен
+            return
         keyboard = InlineKeyboardMarkup()
         keyboard.add(InlineKeyboardButton(text="Да", callback_data="retry search_city"),
                      InlineKeyboardButton(text="Нет", callback_data="stop"))
         if type(ex) is requests.exceptions.ConnectTimeout:
             logger.error(f'Server timeout exceeded!: {ex}')
             bot.send_message(message.from_user.id, "Сервер не отвечает, попробовать еще раз?", reply_markup=keyboard)
+        elif type(ex) is ApiUnavailableError:
+            logger.error(f'{ex}')
+            bot.send_message(message.from_user.id, "Сервер временно недоступен, попробовать еще раз?",
+                             reply_markup=keyboard)
         else:
             logger.error(f'{ex}')
             bot.send_message(message.from_user.id, "Ошибка сервера, попробовать еще раз?", reply_markup=keyboard)
         return
 
-    founded_cities = dict()
-    for i_item in city_data['suggestions']:
-        # создание словаря из всех найденных городов по шаблону пользователя, где ключ - ID, значение - название города
-        if i_item['group'] == 'CITY_GROUP':
-            for j_item in i_item['entities']:
-                if j_item['type'] == 'CITY':
-                    cur_city = re.sub(r'<.*?>', '', j_item['caption'])
-                    founded_cities[j_item['destinationId']] = cur_city
+    if search_scheduler.cancelled():
+        logger.info(f'Search city for user {message.from_user.id} was superseded')
+        return
     cur_user.founded_cities = founded_cities  # сохранение словаря найденных городов в информацию текущего пользователя
 
     if len(cur_user.founded_cities) == 0:
@@ -277,6 +641,8 @@ def callback_buttons(call: CallbackQuery) -> None:
         - если после возникновения ошибки на сервере пользователь решит попробовать выполнить команду еще раз, то
     вызывает соответствующую функцию;
         - если пользователь откажется от попыток выполнить ту же команду, то останавливает выполнение всех команд.
+
+        Обработка нажатий на клавиатуру выбора валюты: сохраняет выбранную валюту в информацию о пользователе.
     """
     if call.data == "retry search_city":  # кнопка "Да" после сообщения об ошибке на сервере при поиске города
         bot.send_message(call.from_user.id, "Введите город, в котором необходимо выполнить поиск:")
@@ -290,6 +656,17 @@ def callback_buttons(call: CallbackQuery) -> None:
         bot.send_message(call.from_user.id, "Работа бота остановлена. Введите любую команду для продолжения.\n/help - "
                                             "список доступных команд")
 
+    if call.data.startswith('currency '):  # кнопка с названием валюты после ввода команды /currency
+        cur_user = users_list[call.from_user.id]
+        new_currency = call.data.split()[1]
+        if exchange_rates.available(new_currency):
+            cur_user.currency = new_currency
+            bot.send_message(call.from_user.id, f'Стоимость номеров будет указываться в {cur_user.currency}')
+        else:
+            bot.send_message(call.from_user.id, f'Курс {new_currency} сейчас недоступен, стоимость номеров по-прежнему '
+                                                f'будет указываться в {cur_user.currency}. Попробуйте выбрать валюту '
+                                                f'позже.')
+
     if call.data.isdigit():  # кнопка "Да" или кнопка с названием города после выполненного поиска городов/города
         cur_user = users_list[call.from_user.id]
         cur_user.city = (call.data, cur_user.founded_cities.get(call.data))
@@ -331,8 +708,9 @@ def set_hotel_num(message: Message) -> None:
 
     if cur_user.command == '/lowprice' or cur_user.command == '/highprice':
         search_hotels(cur_user=cur_user)
-    elif cur_user.command == '/bestdeal':
-        bot.send_message(message.from_user.id, "Введите минимальную стоимость номера за ночь в рублях:")
+    elif cur_user.command == '/bestdeal' or cur_user.command == '/nearby':
+        bot.send_message(message.from_user.id, f"Введите минимальную стоимость номера за ночь в "
+                                               f"{cur_user.currency}:")
         bot.register_next_step_handler(message, set_min_price)
 
 
@@ -347,7 +725,8 @@ def set_min_price(message: Message) -> None:
 
     try:
         users_list[message.from_user.id].min_price = message.text  # проверка корректности введенных данных
-        bot.send_message(message.from_user.id, "Введите максимальную стоимость номера за ночь в рублях:")
+        bot.send_message(message.from_user.id, f"Введите максимальную стоимость номера за ночь в "
+                                               f"{users_list[message.from_user.id].currency}:")
         bot.register_next_step_handler(message, set_max_price)
     except ValueError as ex:
         logger.error('Error: "{ex}" in "{func_name}"'.format(ex=ex, func_name=set_min_price.__name__))
@@ -360,13 +739,21 @@ def set_min_price(message: Message) -> None:
 def set_max_price(message: Message) -> None:
     """ Функция сохраняет максимальное значение стоимости номера за ночь, введенное пользователем.
 
-        После работы передает управление функции set_min_distance.
+        После работы передает управление функции set_min_distance, а для команды /nearby - функции set_location.
     """
     if check_command(message):
         return
 
     try:
         users_list[message.from_user.id].max_price = message.text  # проверка корректности введенных данных
+        if users_list[message.from_user.id].command == '/nearby':
+            keyboard = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
+            keyboard.add(KeyboardButton(text='Отправить моё местоположение', request_location=True))
+            bot.send_message(message.from_user.id, "Отправьте своё местоположение или введите название "
+                                                   "достопримечательности, рядом с которой необходимо найти отели:",
+                             reply_markup=keyboard)
+            bot.register_next_step_handler(message, set_location)
+            return
         bot.send_message(message.from_user.id, "Введите минимальное необходимое расстояние от центра города до отеля "
                                                "в километрах:")
         bot.register_next_step_handler(message, set_min_distance)
@@ -417,125 +804,259 @@ def set_max_distance(message: Message) -> None:
         bot.register_next_step_handler(message, set_max_distance)
 
 
+@logger_dec_commands
+def set_location(message: Message) -> None:
+    """ Функция сохраняет координаты точки, рядом с которой необходимо найти отели по команде /nearby.
+
+        Если пользователь отправил свое местоположение, то сохраняются его координаты и вызывается функция
+    search_hotels для поиска отелей по заданным параметрам. Если введен текст, то он считается названием
+    достопримечательности, координаты которой ищет функция search_landmark. На сообщение другого типа (например,
+    стикер или фото) пользователю повторно предлагается отправить местоположение или название достопримечательности.
+    """
+    cur_user = users_list[message.from_user.id]
+    if message.location is not None:
+        cur_user.location = (message.location.latitude, message.location.longitude)
+        bot.send_message(message.from_user.id, 'Местоположение получено', reply_markup=ReplyKeyboardRemove())
+        search_hotels(cur_user=cur_user)
+        return
+
+    if message.text is None:
+        bot.send_message(message.from_user.id, 'Отправьте своё местоположение или введите название '
+                                               'достопримечательности текстом:')
+        bot.register_next_step_handler(message, set_location)
+        return
+
+    if check_command(message):
+        return
+
+    search_landmark(cur_user, message)
+
+
+@scheduled_search
+@logger_dec_simple
+def search_landmark(cur_user: User, message: Message) -> None:
+    """ Функция ищет на сервере достопримечательность, введенную пользователем по команде /nearby.
+
+        Поиск выполняется в очереди планировщика search_scheduler с копией параметров пользователя на момент
+    постановки в очередь. Если достопримечательность не найдена, то пользователю предлагается ввести другую или
+    отправить свое местоположение. Если найдена, то ее координаты сохраняются в информацию о пользователе и
+    вызывается функция search_hotels для поиска отелей по заданным параметрам. Если пока шел поиск пользователь ввел
+    новую команду, то результат поиска не выводится и поиск отелей не запускается.
+    """
+    try:
+        landmark_name, locale = parse_city_name(message.text)
+        landmark = find_landmark(landmark_name=landmark_name, locale=locale)
+    except Exception as ex:
+        if search_scheduler.cancelled():  # пользователь уже ввел новую команду, результат этого поиска не нужен
+            return
+        logger.error('Error: "{ex}" in "{func_name}"'.format(ex=ex, func_name=search_landmark.__name__))
+        bot.send_message(message.from_user.id, 'Не удалось найти достопримечательность, попробуйте еще раз или '
+                                               'отправьте своё местоположение:')
+        bot.register_next_step_handler(message, set_location)
+        return
+
+    if search_scheduler.cancelled():
+        logger.info(f'Search landmark for user {cur_user.id} was superseded')
+        return
+
+    if landmark is None:
+        bot.send_message(message.from_user.id, 'Такая достопримечательность не найдена, попробуйте ввести другую или '
+                                               'отправьте своё местоположение:')
+        bot.register_next_step_handler(message, set_location)
+        return
+
+    cur_user.location = users_list[cur_user.id].location = (landmark[1], landmark[2])
+    bot.send_message(message.from_user.id, f'Ищем отели рядом с "{landmark[0]}"', reply_markup=ReplyKeyboardRemove())
+    search_hotels(cur_user=cur_user)
+
+
+@scheduled_search
 @logger_dec_simple
 def search_hotels(cur_user: User) -> None:
     """ Функция осуществляет поиск отелей по введенным пользователем параметрам и выводит пользователю результат.
 
-        Формирует разные запросы на сервер в зависимости от команды, введенной пользователем.
-        Формирует список отелей на основании информации, полученной от сервера, и с учетом параметров, указанных
-    пользователем. Если выполняется команда "/lowprice" или "/highprice", то минимальные цена и расстояния от центра
-    города принимаются равными 0, а максимальные - равными 1000000000, чтобы не влиять на выбор отелей для сохранения в
-    список найденных отелей. Отели в списке хранятся в виде экземпляров класса Hotel с информацией о названии отеля, его
-    адресе, стоимости номера за ночь и расстоянии от центра города до отеля.
+        Выбирает порядок сортировки отелей в зависимости от команды, введенной пользователем.
+        Формирует список отелей на основании информации из хранилища отелей hotels_store (при необходимости
+    запрошенной у сервера) и с учетом параметров, указанных пользователем. Если выполняется команда "/lowprice" или
+    "/highprice", то минимальные цена и расстояния от центра города принимаются равными 0, а максимальные - равными
+    1000000000, чтобы не влиять на выбор отелей для сохранения в список найденных отелей. Отели в списке хранятся в
+    виде экземпляров класса Hotel с информацией о названии отеля, его адресе, стоимости номера за ночь и расстоянии от
+    центра города до отеля. Запрошенный диапазон цен переводится из валюты пользователя в базовую валюту, и отели
+    фильтруются функцией fetch_hotels, по возможности прямо в хранилище.
+        Для команды "/nearby" отели выбираются из пространственного индекса всех полученных от сервера отелей в радиусе
+    nearby_radius километров от точки пользователя, фильтруются только по цене (диапазон расстояний от центра города,
+    сохраненный от предыдущей команды /bestdeal, не учитывается) и сортируются по расстоянию до точки. Отели
+    выбранного города добавляются в индекс функцией fetch_hotels, а отели на прошедшие даты заезда из него удаляются.
         Сформированный список сохраняется в экземпляр класса User текущего пользователя.
         Из списка найденных отелей текущего пользователя выводятся в телеграм информационные сообщения о каждом
     найденном отеле.
+        Поиск выполняется в очереди планировщика search_scheduler с копией параметров пользователя на момент
+    постановки в очередь. Если пока шел поиск пользователь ввел новую команду, то результат поиска не выводится.
     """
-    bot.send_message(cur_user.id, "Ожидайте результатов поиска, это может занять какое-то время...")
-    cur_city_id = cur_user.city[0]
-    check_in_date = datetime.now().date()  # дата заезда - день запроса
-    check_out_date = check_in_date + timedelta(days=1)  # дата выезда - следующий день после дня запроса
-    url_hotels = "https://hotels4.p.rapidapi.com/properties/list"
-    headers = {
-        'x-rapidapi-host': "hotels4.p.rapidapi.com",
-        'x-rapidapi-key': os.getenv('KEY')
-    }
+    if not exchange_rates.available(cur_user.currency):
+        logger.warning(f'Exchange rate of {cur_user.currency} is unavailable')
+        bot.send_message(cur_user.id, f'Курс {cur_user.currency} сейчас недоступен, поэтому поиск в этой валюте '
+                                      f'невозможен. Повторите поиск позже или выберите другую валюту командой '
+                                      f'/currency.')
+        return
 
-    if cur_user.command == '/lowprice':  # формирование строки-запроса в соответствии с командой пользователя
-        querystring = {"destinationId": cur_city_id,
-                       "pageNumber": "1",
-                       "pageSize": cur_user.hotels_num,
-                       "checkIn": str(check_in_date),
-                       "checkOut": str(check_out_date),
-                       "adults1": "1",
-                       "sortOrder": "PRICE",
-                       "locale": 'ru_RU',
-                       "currency": "RUB"}
-    elif cur_user.command == '/highprice':
-        querystring = {"destinationId": cur_city_id,
-                       "pageNumber": "1",
-                       "pageSize": cur_user.hotels_num,
-                       "checkIn": str(check_in_date),
-                       "checkOut": str(check_out_date),
-                       "adults1": "1",
-                       "sortOrder": "PRICE_HIGHEST_FIRST",
-                       "locale": 'ru_RU',
-                       "currency": "RUB"}
-    elif cur_user.command == '/bestdeal':
-        querystring = {"destinationId": cur_city_id,
-                       "pageNumber": "1",
-                       "pageSize": "50",
-                       "checkIn": str(check_in_date),
-                       "checkOut": str(check_out_date),
-                       "adults1": "1",
-                       "sortOrder": "PRICE",
-                       "locale": 'ru_RU',
-                       "currency": "RUB",
-                       }
+    bot.send_message(cur_user.id, "Ожидайте результатов поиска, это может занять какое-то время...")
+    if cur_user.command == '/highprice':  # выбор порядка сортировки в соответствии с командой пользователя
+        sort_order = 'PRICE_HIGHEST_FIRST'
+    else:
+        sort_order = 'PRICE'
 
+    min_price = exchange_rates.to_base(float(cur_user.min_price), cur_user.currency)
+    max_price = exchange_rates.to_base(float(cur_user.max_price), cur_user.currency)
+    # диапазон цен в базовой валюте, в которой отели хранятся в хранилище
     try:
         # в случае ошибки на сервере или превышении времени ожидания ответа - выдает соответствующее сообщение
-        response_hotels = requests.request("GET", url_hotels, headers=headers, params=querystring, timeout=10)
-        if response_hotels.status_code == 200:
-            hotels_data = json.loads(response_hotels.text)
+        if cur_user.command == '/nearby':  # в индекс добавляются все отели выбранного города
+            hotels = fetch_hotels(city_id=cur_user.city[0], sort_order=sort_order)
         else:
-            raise
+            hotels = fetch_hotels(city_id=cur_user.city[0],
+                                  sort_order=sort_order,
+                                  min_price=min_price,
+                                  max_price=max_price,
+                                  min_distance=float(cur_user.min_distance),
+                                  max_distance=float(cur_user.max_distance),
+                                  limit=int(cur_user.hotels_num))
     except Exception as ex:
+        if search_scheduler.cancelled():  # пользователь уже запустил новый поиск, результат этого поиска не нужен
+            return
         keyboard = InlineKeyboardMarkup()
         keyboard.add(InlineKeyboardButton(text="Да", callback_data="retry search_hotels"),
                      InlineKeyboardButton(text="Нет", callback_data="stop"))
         if type(ex) is requests.exceptions.ConnectTimeout:
             logger.error(f'Server timeout exceeded!: {ex}')
             bot.send_message(cur_user.id, "Сервер не отвечает, попробовать еще раз?", reply_markup=keyboard)
+        elif type(ex) is ApiUnavailableError:
+            logger.error(f'{ex}')
+            bot.send_message(cur_user.id, "Сервер временно недоступен, попробовать еще раз?", reply_markup=keyboard)
         else:
             logger.error(f'{ex}')
             bot.send_message(cur_user.id, "Ошибка сервера, попробовать еще раз?", reply_markup=keyboard)
         return
 
-    founded_hotels = []
-    if hotels_data['result'] == 'OK':
-        hotels_list = hotels_data['data']['body']['searchResults']['results']
-        for hotel in hotels_list:
-            hotel_name = hotel['name']
-            if hotel.get('address').get('extendedAddress'):
-                if hotel['address']['extendedAddress'] != '':
-                    hotel_address = ' '.join((hotel['address']['streetAddress'],
-                                              hotel['address']['extendedAddress'],
-                                              hotel['address']['locality']))
-                else:
-                    hotel_address = ', '.join((hotel['address']['streetAddress'], hotel['address']['locality']))
-            else:
-                hotel_address = cur_user.city[1]
-            hotel_distance = hotel['landmarks'][0]['distance']
-            hotel_price = hotel['ratePlan']['price']['current']
-
-            check_distance = re.sub(r"[^0123456789,]", "", hotel_distance)
-            check_distance = re.sub(r",", ".", check_distance)  # численное значение расстояния до центра города
-            check_price = re.sub(r"[^0123456789]", "", hotel_price)  # численное значение стоимости номера в отеле
-
-            if ((float(cur_user.min_distance) < float(check_distance) < float(cur_user.max_distance))
-                    and (float(cur_user.min_price) < float(check_price) < float(cur_user.max_price))):
-                founded_hotels.append(Hotel(name=hotel_name,
-                                            address=hotel_address,
-                                            distance=hotel_distance,
-                                            price=hotel_price))
-
-            if len(founded_hotels) == int(cur_user.hotels_num):
-                break
-
-        cur_user.founded_hotels = founded_hotels
-    else:
-        logger.error('Search hotels ERROR! Result is not "OK"')
-        bot.send_message(cur_user.id, 'Возникла непредвиденная ошибка, попробуйте снова.')
+    if search_scheduler.cancelled():
+        logger.info(f'Search hotels for user {cur_user.id} was superseded')
         return
 
-    if len(cur_user.founded_hotels) > 0:
-        bot.send_message(cur_user.id, f'Найдено {len(cur_user.founded_hotels)} отелей, соответствующих требованиям:')
-        for hotel in cur_user.founded_hotels:
-            bot.send_message(cur_user.id, str(hotel))
+    distances = dict()  # расстояния от точки пользователя до отелей для команды /nearby, где ключ - ID отеля
+    if cur_user.command == '/nearby':
+        nearby_hotels = hotels_index.nearby(latitude=cur_user.location[0],
+                                            longitude=cur_user.location[1],
+                                            radius=nearby_radius)
+        founded_hotels = [hotel for _, hotel in nearby_hotels
+                          if min_price < hotel.price < max_price][:int(cur_user.hotels_num)]
+        # расстояние от центра города для /nearby не запрашивается, поэтому отели фильтруются только по цене и радиусу
+        distances = {hotel.id: distance for distance, hotel in nearby_hotels}
+    else:
+        founded_hotels = hotels
+
+    users_list[cur_user.id].founded_hotels = founded_hotels  # cur_user - копия, результат сохраняется в оригинал
+
+    if len(founded_hotels) > 0:
+        bot.send_message(cur_user.id, f'Найдено {len(founded_hotels)} отелей, соответствующих требованиям:')
+        for hotel in founded_hotels:
+            hotel_text = hotel.description(price=exchange_rates.format(hotel.price, cur_user.currency))
+            if hotel.id in distances:
+                hotel_text += '\n\t- расстояние до указанной точки: {} км'.format(
+                    '{:.1f}'.format(distances[hotel.id]).replace('.', ','))
+            bot.send_message(cur_user.id, hotel_text)
     else:
         bot.send_message(cur_user.id, f'Отелей, соответствующих требованиям, не найдено.')
 
 
+def search_cheapest_hotels(city_text: str) -> Tuple[str, List[Hotel]]:
+    """ Функция ищет самые дешевые отели в одном городе для команды /compare.
+
+        Ищет город по тексту, введенному пользователем, и выбирает первый из найденных городов. Затем запрашивает у
+    сервера самые дешевые отели в этом городе. Возвращает кортеж из названия найденного города и списка отелей. Если
+    город не найден, то список отелей пустой. При ошибке сервера или некорректном названии города передает исключение
+    дальше.
+    """
+    city_name, locale = parse_city_name(city_text)
+    founded_cities = find_cities(city_name=city_name, locale=locale)
+    if len(founded_cities) == 0:
+        return city_text, []
+
+    city_id, city_name = next(iter(founded_cities.items()))
+    return city_name, fetch_hotels(city_id=city_id, sort_order='PRICE', limit=compare_hotels_num)
+
+
+@logger_dec_commands
+def compare_cities(message: Message) -> None:
+    """ Функция получает от пользователя города для команды /compare, введенные через запятую.
+
+        Если количество городов некорректно, то предлагает ввести их еще раз. Иначе вызывает функцию compare_hotels
+    для сравнения самых дешевых отелей в этих городах.
+    """
+    if check_command(message):
+        return
+
+    cities = [city.strip() for city in message.text.split(',') if city.strip() != '']
+    if not 0 < len(cities) <= compare_cities_num:
+        bot.send_message(message.from_user.id, f"Необходимо ввести от 1 до {compare_cities_num} городов через "
+                                               f"запятую, попробуйте еще раз:")
+        bot.register_next_step_handler(message, compare_cities)
+        return
+
+    compare_hotels(cur_user=users_list[message.from_user.id], cities=cities)
+
+
+@scheduled_search
+@logger_dec_simple
+def compare_hotels(cur_user: User, cities: List[str]) -> None:
+    """ Функция сравнивает самые дешевые отели в нескольких городах.
+
+        Поиск в каждом городе (поиск города и поиск отелей в нем) выполняется одновременно в отдельных потоках пула
+    search_executor, поэтому общее время ожидания близко ко времени поиска в самом медленном городе, если хватает
+    общей квоты запросов к серверу. Пул рассчитан на compare_cities_num городов для каждого рабочего потока
+    планировщика поиска, поэтому команда /compare одного пользователя не задерживает поиски других пользователей.
+    Запросы используют общий кэш. Стоимость номеров выводится в валюте пользователя.
+        Результат выводится пользователю одной таблицей, города в которой отсортированы по стоимости самого дешевого
+    отеля. Если в каком-то городе поиск не удался, то об этом сообщается в строке этого города.
+        Сравнение выполняется в очереди планировщика search_scheduler с копией параметров пользователя на момент
+    постановки в очередь. Если пока шло сравнение пользователь ввел новую команду, то результат не выводится.
+    """
+    if not exchange_rates.available(cur_user.currency):
+        logger.warning(f'Exchange rate of {cur_user.currency} is unavailable')
+        bot.send_message(cur_user.id, f'Курс {cur_user.currency} сейчас недоступен, поэтому поиск в этой валюте '
+                                      f'невозможен. Повторите поиск позже или выберите другую валюту командой '
+                                      f'/currency.')
+        return
+
+    bot.send_message(cur_user.id, "Ожидайте результатов сравнения, это может занять какое-то время...")
+    searches = [search_executor.submit(search_cheapest_hotels, city) for city in cities]
+    wait(searches)
+    if search_scheduler.cancelled():
+        logger.info(f'Compare hotels for user {cur_user.id} was superseded')
+        return
+
+    currency = cur_user.currency
+    found_rows = []
+    failed_rows = []
+    for city, search in zip(cities, searches):
+        try:
+            city_name, hotels = search.result()
+        except Exception as ex:
+            logger.error('Error: "{ex}" in "{func_name}" for city "{city}"'.format(
+                ex=ex, func_name=compare_hotels.__name__, city=city))
+            failed_rows.append(f'{city}: ошибка поиска, попробуйте позже')
+            continue
+        if len(hotels) == 0:
+            failed_rows.append(f'{city}: город или отели не найдены')
+            continue
+        rows = '\n'.join(f'\t{number}. {hotel.name} - {exchange_rates.format(hotel.price, currency)}'
+                         for number, hotel in enumerate(hotels, 1))
+        found_rows.append((min(hotel.price for hotel in hotels), f'{city_name}:\n{rows}'))
+
+    found_rows.sort(key=lambda row: row[0])
+    bot.send_message(cur_user.id,
+                     'Самые дешёвые отели по городам:\n\n' + '\n\n'.join([row[1] for row in found_rows] + failed_rows))
+
+
 if __name__ == '__main__':
+    update_exchange_rates()
     bot.polling()